@@ -3,25 +3,26 @@
 Input cleaning utilities for better LLM processing.
 """
 
+import re
+
+# Only remove truly redundant patterns:
+#   [SHIFT] - Shift effect is already in capitalization
+#   [CTRL]  - Ctrl combinations are handled separately
+#   [ALT]   - Alt combinations are handled separately
+# Each match is a run of noise tokens and/or spaces that needs rewriting, so
+# noise removal and space collapsing happen in a single pass over the input.
+_NOISE_OR_SPACES = re.compile(r"(?: *(?:\[SHIFT\]|\[CTRL\]|\[ALT\]))+ *| {2,}")
+
+def _collapse_run(match: "re.Match[str]") -> str:
+    """Replace a noise/space run with one space if it held any spacing."""
+    return " " if " " in match.group() else ""
+
 def clean_input_for_llm(input_sequence: str) -> str:
     """Clean up the input sequence minimally while preserving context for LLM."""
     
-    # Only do minimal cleaning - preserve most special keys for context
-    cleaned = input_sequence
-    
-    # Only remove truly redundant patterns
-    noise_patterns = [
-        "[SHIFT]",  # Shift effect is already in capitalization
-        "[CTRL]",   # Ctrl combinations are handled separately 
-        "[ALT]",    # Alt combinations are handled separately
-    ]
-    
-    for pattern in noise_patterns:
-        cleaned = cleaned.replace(pattern, "")
-    
-    # Clean up multiple spaces but preserve intentional spacing
-    while "  " in cleaned:
-        cleaned = cleaned.replace("  ", " ")
+    # Only do minimal cleaning - preserve most special keys for context,
+    # and clean up multiple spaces but preserve intentional spacing
+    cleaned = _NOISE_OR_SPACES.sub(_collapse_run, input_sequence)
     
     # Don't strip - preserve leading/trailing context
     
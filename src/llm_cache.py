@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Response caches for WinOpAuto
+Stores LLM responses in a small SQLite file so repeated requests skip the API.
+"""
+
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Optional, List
+
+class ResponseCache:
+    """Exact-match cache of LLM responses, persisted to SQLite."""
+    
+    def __init__(self, path: str, ttl: float = 86400):
+        """Open (or create) the cache file. A ttl <= 0 keeps entries forever."""
+        self.ttl = ttl
+        # Handlers may be called from worker threads (see agenerate_response)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            # Most keys are never looked up again, so expired rows are dropped here
+            # rather than on lookup; otherwise the file would grow without bound
+            if ttl > 0:
+                self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - ttl,))
+    
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """Hash the parts that determine a response into a cache key."""
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None if missing or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            
+            response, created = row
+            if self.ttl > 0 and time.time() - created > self.ttl:
+                with self._conn:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            return response
+    
+    def set(self, key: str, response: str) -> None:
+        """Store a response under key, replacing any previous entry."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                (key, response, time.time())
+            )
+    
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+class SemanticCache:
+    """Nearest-neighbour cache of LLM responses keyed by prompt embeddings."""
+    
+    # Needs the optional numpy and sentence-transformers packages. Entries are
+    # grouped by scope so different models or system prompts never share answers.
+    
+    def __init__(self, path: str, threshold: float = 0.92, ttl: float = 86400,
+                 model_name: str = "all-MiniLM-L6-v2"):
+        """Open (or create) the cache file; fails fast if the packages are missing."""
+        import numpy
+        import sentence_transformers
+        self._np = numpy
+        self._st = sentence_transformers
+        self.threshold = threshold
+        self.ttl = ttl
+        self.model_name = model_name
+        self._embedder = None  # Loading the model is slow, so wait until it is needed
+        self._index = {}  # scope -> (normalized vectors, responses)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS semantic_responses ("
+                "scope TEXT NOT NULL, vector BLOB NOT NULL, response TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            if ttl > 0:
+                self._conn.execute("DELETE FROM semantic_responses WHERE created < ?", (time.time() - ttl,))
+    
+    def _embed(self, text: str):
+        """Return the unit-length embedding of text."""
+        if self._embedder is None:
+            self._embedder = self._st.SentenceTransformer(self.model_name)
+        vector = self._embedder.encode(text, normalize_embeddings=True)
+        return self._np.asarray(vector, dtype=self._np.float32)
+    
+    def _load_scope(self, scope: str):
+        """Load (once) the stored vectors and responses for a scope."""
+        entry = self._index.get(scope)
+        if entry is not None:
+            return entry
+        
+        np = self._np
+        min_created = time.time() - self.ttl if self.ttl > 0 else 0
+        rows = self._conn.execute(
+            "SELECT vector, response FROM semantic_responses WHERE scope = ? AND created >= ?",
+            (scope, min_created)
+        ).fetchall()
+        responses: List[str] = [response for _, response in rows]
+        if rows:
+            vectors = np.stack([np.frombuffer(blob, dtype=np.float32) for blob, _ in rows])
+        else:
+            vectors = None
+        entry = self._index[scope] = (vectors, responses)
+        return entry
+    
+    def get(self, scope: str, text: str) -> Optional[str]:
+        """Return the response of the most similar stored prompt, if close enough."""
+        with self._lock:
+            vectors, responses = self._load_scope(scope)
+            if vectors is None:
+                return None
+            
+            scores = vectors @ self._embed(text)
+            best = int(scores.argmax())
+            if scores[best] >= self.threshold:
+                return responses[best]
+            return None
+    
+    def set(self, scope: str, text: str, response: str) -> None:
+        """Store a response under the embedding of text."""
+        with self._lock:
+            vectors, responses = self._load_scope(scope)
+            vector = self._embed(text)
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO semantic_responses (scope, vector, response, created) VALUES (?, ?, ?, ?)",
+                    (scope, vector.tobytes(), response, time.time())
+                )
+            
+            if vectors is None:
+                vectors = vector[None, :]
+            else:
+                vectors = self._np.vstack((vectors, vector))
+            self._index[scope] = (vectors, responses + [response])
+    
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
@@ -4,23 +4,282 @@ LLM Handler for WinOpAuto
 Supports OpenAI and DeepSeek APIs with configurable settings.
 """
 
+import gc
 import os
+import re
+import time
+import asyncio
+import threading
+import functools
 import json
+import sqlite3
 import requests
-from typing import Optional, Dict, Any
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.util.request import ACCEPT_ENCODING
+from typing import Optional, Dict, Any, List, Iterator
+
+from llm_cache import ResponseCache, SemanticCache
+
+try:
+    # orjson is optional; it is faster and encodes straight to bytes
+    import orjson
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+    _json_loads = json.loads
+
+_OPENAI_URL = "https://api.openai.com/v1/chat/completions"
+_DEEPSEEK_URL = "https://api.deepseek.com/v1/chat/completions"
+
+# Stand-in user prompt used to pre-serialize request bodies
+_PROMPT_SLOT = "\x00input\x00"
+
+# Markdown header lines (optionally indented) including their newline
+_MD_HEADER_RE = re.compile(r"^[^\S\n]*#.*\n?", re.MULTILINE)
+
+# Verbs that mark an input as a COMMAND with side effects; its response is never cached
+_COMMAND_VERBS = (
+    "send", "delete", "remove", "run", "launch", "open", "close", "click",
+    "install", "shutdown", "reboot", "write", "edit",
+)
+
+def _compile_command_re(verbs) -> "re.Pattern[str]":
+    """Compile a whole-word, case-insensitive matcher for the given verbs."""
+    return re.compile(r"\b(?:" + "|".join(re.escape(v) for v in verbs) + r")\b", re.IGNORECASE)
+
+_COMMAND_RE = _compile_command_re(_COMMAND_VERBS)
+_NEVER_RE = re.compile(r"(?!)")  # For "command_verbs": [], which turns the cache bypass off
+
+# Reasoning models (o3, o1 series) use different parameter names
+_REASONING_MODELS = ("o3", "o3-mini", "o1", "o1-mini", "o1-preview")
+
+@functools.lru_cache(maxsize=16)
+def _read_json_file(file_path: str, mtime_ns: int, size: int) -> Dict[str, Any]:
+    """Parse a JSON file; cached per (path, mtime, size) so unchanged files parse once."""
+    with open(file_path, 'rb') as f:
+        return _json_loads(f.read())
+
+class TokenBucket:
+    """Client-side rate limiter allowing `rate` requests per second, in bursts of up to `burst`."""
+    
+    def __init__(self, rate: float, burst: float):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        # A thread lock rather than asyncio.Lock: requests are issued from worker
+        # threads, and each generate_responses call runs its own event loop
+        self._lock = threading.Lock()
+    
+    def _reserve(self, n: float) -> float:
+        """Take n tokens and return how long to wait until they are available."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= n
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+    
+    def acquire(self, n: float = 1) -> None:
+        """Block until n tokens are available."""
+        wait = self._reserve(n)
+        if wait > 0:
+            time.sleep(wait)
+
+def freeze_gc_before_fork() -> None:
+    """Move every live object into the permanent GC generation.
+    
+    Opt-in, for POSIX parents only: call it right before forking workers so the
+    GC never writes to the shared pages of handlers built in the parent. It is
+    pointless on Windows, where multiprocessing spawns instead of forking.
+    Frozen objects are never collected, so garbage is collected first.
+    """
+    gc.collect()
+    gc.freeze()
 
 class LLMHandler:
-    """Handles LLM interactions with multiple providers."""
+    """Handles LLM interactions with multiple providers.
+    
+    When forking worker processes, construct the handler in the parent and call
+    freeze_gc_before_fork() so the children share its loaded config pages.
+    """
+    
+    __slots__ = (
+        "debug", "secrets", "config", "provider",
+        "_system_prompt", "_system_message", "_providers", "_session", "_cache", "_semantic_cache", "_command_re",
+        "_model", "_max_tokens", "_temperature", "_user_prompt_template", "_limiter",
+        "_max_prompt_chars", "_denylist", "_prompt_parts",
+    )
     
     def __init__(self, secrets_file: str = "SECRET", config_file: str = "LLM_config.json", debug: bool = False):
         """Initialize LLM handler with configuration from two files."""
+        self._setup(self._load_json_file(secrets_file), self._load_json_file(config_file), debug)
+    
+    @classmethod
+    def from_dict(cls, config: Dict[str, Any], secrets: Optional[Dict[str, Any]] = None, debug: bool = False) -> "LLMHandler":
+        """Create a handler from in-memory config and secrets instead of files."""
+        handler = cls.__new__(cls)
+        handler._setup(dict(secrets or {}), dict(config), debug)
+        return handler
+    
+    def _setup(self, secrets: Dict[str, Any], config: Dict[str, Any], debug: bool) -> None:
+        """Set up the handler from loaded secrets and config."""
         self.debug = debug
-        self.secrets = self._load_json_file(secrets_file)
-        self.config = self._load_json_file(config_file)
+        self.secrets = secrets
+        self.config = config
         self.provider = self.config.get("provider", "openai").lower()
+        self._system_prompt = None  # Loaded lazily, then reused across requests
+        self._system_message = None
+        
+        # Everything below is fixed for the lifetime of the handler, so work it out once
+        self._model = self._get_model_name()
+        self._max_tokens = self.config.get("max_tokens", 100)
+        self._temperature = self.config.get("temperature", 0.7)
+        self._user_prompt_template = self.config.get("user_prompt_template",
+            "The user's input sequence: '{input}'\n\nNext keyboard input:")
+        self._prompt_parts = self._split_prompt_template(self._user_prompt_template)
+        
+        openai_model = self.config.get("openai_model", "gpt-3.5-turbo")
+        openai_reasoning = any(rm in openai_model.lower() for rm in _REASONING_MODELS)
+        self._providers = {
+            "openai": {
+                "name": "OpenAI",
+                "tag": "OPENAI",
+                "url": self.config.get("openai_url", _OPENAI_URL),
+                "headers": self._build_headers(self.secrets.get("openai_api_key")),
+                "params": self._build_openai_params(openai_model, openai_reasoning),
+                "reasoning": openai_reasoning,
+            },
+            "deepseek": {
+                "name": "DeepSeek",
+                "tag": "DEEPSEEK",
+                "url": self.config.get("deepseek_url", _DEEPSEEK_URL),
+                "headers": self._build_headers(self.secrets.get("deepseek_api_key")),
+                "params": {
+                    "model": self.config.get("deepseek_model", "deepseek-chat"),
+                    "max_tokens": self._max_tokens,
+                    "temperature": self._temperature
+                },
+                "reasoning": False,
+            },
+        }
+        
+        # Keep-alive session so repeated requests reuse the TCP/TLS connection.
+        # Transient failures are retried with backoff; once retries run out the
+        # last response is returned so the status handling below still applies.
+        retry = Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["POST"]),
+            raise_on_status=False,
+        )
+        self._session = requests.Session()
+        # Ask for every compression urllib3 can decode here (br/zstd when their
+        # optional packages are installed), not just requests' default gzip/deflate
+        self._session.headers.update({
+            "Content-Type": "application/json",
+            "Accept-Encoding": ACCEPT_ENCODING,
+        })
+        self._session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry))
+        
+        # Stay under the provider's rate limit instead of running into 429 backoff
+        qps = self.config.get("qps", 10)
+        self._limiter = TokenBucket(rate=qps, burst=self.config.get("burst", 20)) if qps > 0 else None
+        
+        # Inputs that are rejected before any request is made
+        self._max_prompt_chars = self.config.get("max_prompt_chars", 0)  # 0 = no limit
+        self._denylist = [re.compile(p) for p in self.config.get("deny_patterns", [])]
+        
+        command_verbs = self.config.get("command_verbs")
+        if command_verbs is None:
+            self._command_re = _COMMAND_RE
+        elif command_verbs:
+            self._command_re = _compile_command_re(command_verbs)
+        else:
+            self._command_re = _NEVER_RE
+        self._cache = self._open_cache()
+        self._semantic_cache = self._open_semantic_cache()
         
         print(f"[LLM] Initialized with provider: {self.provider}")
-        print(f"[LLM] Using model: {self._get_model_name()}")
+        print(f"[LLM] Using model: {self._model}")
+    
+    def _build_headers(self, api_key: Optional[str]) -> Optional[Dict[str, str]]:
+        """Build per-request auth headers for an API key, or None if the key is missing."""
+        if not api_key:
+            return None
+        # Content-Type is set once on the session
+        return {"Authorization": f"Bearer {api_key}"}
+    
+    def _build_openai_params(self, model: str, reasoning: bool) -> Dict[str, Any]:
+        """Build the per-request-invariant part of the OpenAI payload."""
+        params = {"model": model}
+        
+        # Use appropriate token parameter based on model type
+        if reasoning:
+            # Reasoning models need much more tokens (they use tokens for internal reasoning)
+            reasoning_tokens = self._max_tokens
+            # For reasoning models, we need extra tokens beyond the configured amount
+            # because they use tokens for reasoning AND for the final output
+            params["max_completion_tokens"] = max(reasoning_tokens * 10, 1000)  # At least 1000 tokens for reasoning models
+        else:
+            params["max_tokens"] = self._max_tokens
+            # Some reasoning models don't support temperature parameter
+            params["temperature"] = self._temperature
+        
+        return params
+    
+    def _open_cache(self) -> Optional[ResponseCache]:
+        """Open the on-disk response cache, unless disabled in the config."""
+        if not self.config.get("cache_enabled", True):
+            return None
+        
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        cache_path = os.path.join(script_dir, self.config.get("cache_file", ".llm_cache.sqlite3"))
+        try:
+            return ResponseCache(cache_path, ttl=self.config.get("cache_ttl", 86400))
+        except Exception as e:
+            # Caching is an optimization; carry on without it
+            print(f"[WARNING] Response cache unavailable: {e}")
+            return None
+    
+    def _open_semantic_cache(self) -> Optional[SemanticCache]:
+        """Open the embedding-based response cache, if enabled in the config."""
+        if not self.config.get("semantic_cache_enabled", False):
+            return None
+        
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        cache_path = os.path.join(script_dir, self.config.get("cache_file", ".llm_cache.sqlite3"))
+        try:
+            return SemanticCache(
+                cache_path,
+                threshold=self.config.get("semantic_threshold", 0.92),
+                ttl=self.config.get("cache_ttl", 86400),
+                model_name=self.config.get("semantic_model", "all-MiniLM-L6-v2"),
+            )
+        except ImportError as e:
+            print(f"[WARNING] Semantic cache needs numpy and sentence-transformers: {e}")
+            return None
+        except Exception as e:
+            print(f"[WARNING] Semantic cache unavailable: {e}")
+            return None
+    
+    def _classify_intent(self, text: str) -> str:
+        """Tag input as COMMAND (has side effects) or INFORMATIONAL."""
+        return "COMMAND" if self._command_re.search(text) else "INFORMATIONAL"
+    
+    def _cache_scope(self) -> str:
+        """Hash everything except the input that shapes the response."""
+        return ResponseCache.make_key(
+            self.provider,
+            self._model,
+            str(self._max_tokens),
+            str(self._temperature),
+            self._get_system_prompt(),
+        )
     
     def _load_json_file(self, filename: str) -> Dict[str, Any]:
         """Load configuration from JSON file."""
@@ -31,10 +290,10 @@ class LLMHandler:
             raise FileNotFoundError(f"Configuration file not found: {file_path}")
         
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            st = os.stat(file_path)
+            data = _read_json_file(file_path, st.st_mtime_ns, st.st_size)
             print(f"[CONFIG] Loaded {filename}")
-            return data
+            return dict(data)  # Shallow copy so handlers never share one cached dict
         except json.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON in {filename}: {e}")
         except Exception as e:
@@ -57,24 +316,16 @@ class LLMHandler:
             raise Exception(f"Failed to load {filename}: {e}")
     
     def _get_system_prompt(self) -> str:
-        """Get system prompt from file."""
+        """Get system prompt from file (cached after the first load)."""
+        if self._system_prompt is not None:
+            return self._system_prompt
+        
         system_prompt_file = self.config.get("system_prompt_file", "system_prompt.md")
         content = self._load_markdown_file(system_prompt_file)
         
         # Remove markdown headers and convert to plain text
-        lines = content.split('\n')
-        plain_lines = []
-        for line in lines:
-            # Skip markdown headers (lines starting with #)
-            if line.strip().startswith('#'):
-                continue
-            # Skip empty lines at the beginning
-            if not plain_lines and not line.strip():
-                continue
-            plain_lines.append(line)
-        
-        # Join lines and clean up
-        return '\n'.join(plain_lines).strip()
+        self._system_prompt = _MD_HEADER_RE.sub("", content).strip()
+        return self._system_prompt
     
 
     
@@ -86,76 +337,254 @@ class LLMHandler:
             return self.config.get("deepseek_model", "deepseek-chat")
         return "unknown"
     
+    def _should_send(self, input_sequence: str) -> bool:
+        """Check input before any request; False for empty or denied input.
+        
+        Raises ValueError if the input is longer than max_prompt_chars.
+        """
+        stripped = input_sequence.strip()
+        if not stripped:
+            return False
+        if self._max_prompt_chars and len(stripped) > self._max_prompt_chars:
+            raise ValueError(f"Input is {len(stripped)} characters; max_prompt_chars is {self._max_prompt_chars}")
+        for pattern in self._denylist:
+            if pattern.search(input_sequence):
+                print(f"[LLM] Input matches deny pattern '{pattern.pattern}', skipping request")
+                return False
+        return True
+    
     def generate_response(self, input_sequence: str) -> Optional[str]:
         """Generate response using configured LLM provider."""
-        if self.provider == "openai":
-            return self._openai_request(input_sequence)
-        elif self.provider == "deepseek":
-            return self._deepseek_request(input_sequence)
-        else:
+        # Answer trivial or disallowed input without a round trip
+        if not self._should_send(input_sequence):
+            return ""
+        
+        cache = self._cache
+        semantic_cache = self._semantic_cache
+        if cache is None and semantic_cache is None:
+            return self._provider_request(input_sequence)
+        
+        # Serving a stale answer to a command could repeat or misstate an action
+        if self._classify_intent(input_sequence) == "COMMAND":
+            if self.debug:
+                print("[DEBUG] Command-like input, bypassing response cache")
+            return self._provider_request(input_sequence)
+        
+        scope = self._cache_scope()
+        user_prompt = self._build_user_prompt(input_sequence)
+        key = ResponseCache.make_key(scope, user_prompt)
+        
+        if cache is not None:
+            try:
+                cached = cache.get(key)
+            except sqlite3.Error as e:
+                # Caching is an optimization; treat a failed lookup as a miss
+                print(f"[WARNING] Response cache lookup failed: {e}")
+                cached = None
+            if cached is not None:
+                print(f"[CACHE] Using cached response: {len(cached)} characters")
+                return cached
+        
+        if semantic_cache is not None:
+            # Embeddings from different models can't be compared, and the raw input
+            # is embedded, so the template has to be part of the scope too
+            semantic_scope = ResponseCache.make_key(scope, semantic_cache.model_name, self._user_prompt_template)
+            try:
+                cached = semantic_cache.get(semantic_scope, input_sequence)
+            except Exception as e:
+                # The embedding model loads on first use and can fail (e.g. offline)
+                print(f"[WARNING] Semantic cache unavailable: {e}")
+                semantic_cache = self._semantic_cache = None
+                cached = None
+            if cached is not None:
+                print(f"[CACHE] Using semantically similar cached response: {len(cached)} characters")
+                return cached
+        
+        response = self._provider_request(input_sequence)
+        if response:
+            if cache is not None:
+                try:
+                    cache.set(key, response)
+                except sqlite3.Error as e:
+                    print(f"[WARNING] Failed to store response in cache: {e}")
+            if semantic_cache is not None:
+                try:
+                    semantic_cache.set(semantic_scope, input_sequence, response)
+                except Exception as e:
+                    print(f"[WARNING] Semantic cache unavailable: {e}")
+                    self._semantic_cache = None
+        return response
+    
+    def _provider_config(self) -> Dict[str, Any]:
+        """Get the request settings for the configured provider."""
+        cfg = self._providers.get(self.provider)
+        if cfg is None:
             raise ValueError(f"Unsupported LLM provider: {self.provider}")
+        if cfg["headers"] is None:
+            raise ValueError(f"{cfg['name']} API key not found in SECRET file")
+        return cfg
     
-    def _openai_request(self, input_sequence: str) -> Optional[str]:
-        """Make request to OpenAI API."""
-        api_key = self.secrets.get("openai_api_key")
-        if not api_key:
-            raise ValueError("OpenAI API key not found in SECRET file")
+    def _provider_request(self, input_sequence: str) -> Optional[str]:
+        """Send the request to the configured provider."""
+        return self._chat_completions(self._provider_config(), input_sequence)
+    
+    def stream_response(self, input_sequence: str) -> Iterator[str]:
+        """Yield the response text in pieces as the provider generates it."""
+        if not self._should_send(input_sequence):
+            return
+        cfg = self._provider_config()
+        url, headers, params, tag = cfg["url"], cfg["headers"], cfg["params"], cfg["tag"]
         
-        model = self.config.get("openai_model", "gpt-3.5-turbo")
+        data = {**params, "messages": self._build_messages(input_sequence), "stream": True}
         
-        url = "https://api.openai.com/v1/chat/completions"
+        try:
+            print(f"[{tag}] Streaming request to {params['model']}...")
+            if self._limiter is not None:
+                self._limiter.acquire()
+            with self._session.post(url, headers=headers, data=_json_dumps(data), timeout=30, stream=True) as response:
+                response.raise_for_status()
+                
+                # Server-sent events: "data: {json}" lines, terminated by "data: [DONE]"
+                for line in response.iter_lines():
+                    if not line.startswith(b"data: "):
+                        continue
+                    payload = line[6:]
+                    if payload == b"[DONE]":
+                        break
+                    
+                    choices = _json_loads(payload).get("choices")
+                    if choices:
+                        content = choices[0].get("delta", {}).get("content")
+                        if content:
+                            yield content
+                            
+        except requests.exceptions.RequestException as e:
+            print(f"[ERROR] {tag} streaming request failed: {e}")
+        except ValueError as e:
+            print(f"[ERROR] Invalid {tag} stream chunk: {e}")
+    
+    async def agenerate_response(self, input_sequence: str) -> Optional[str]:
+        """Async version of generate_response; the request runs on a worker thread."""
+        return await asyncio.to_thread(self.generate_response, input_sequence)
+    
+    async def agenerate_many(self, inputs: List[str], concurrency: int = 8) -> List[Any]:
+        """Generate responses for many inputs, with at most `concurrency` in flight.
         
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+        Results keep the order of inputs; a failed input yields its exception.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
         
-        system_prompt = self._get_system_prompt()
-        user_prompt = self._build_user_prompt(input_sequence)
+        async def one(input_sequence: str) -> Optional[str]:
+            async with semaphore:
+                return await self.agenerate_response(input_sequence)
         
-        # Reasoning models (o3, o1 series) use different parameter names
-        reasoning_models = ["o3", "o3-mini", "o1", "o1-mini", "o1-preview"]
-        is_reasoning_model = any(reasoning_model in model.lower() for reasoning_model in reasoning_models)
+        return await asyncio.gather(*map(one, inputs), return_exceptions=True)
+    
+    def generate_responses(self, inputs: List[str], concurrency: int = 8) -> List[Any]:
+        """Blocking version of agenerate_many."""
+        return asyncio.run(self.agenerate_many(inputs, concurrency))
+    
+    async def aprocess_file(self, input_jsonl: str, output_jsonl: str, concurrency: int = 8) -> int:
+        """Answer {"id", "input"} records from input_jsonl, appending results to output_jsonl.
         
-        data = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-        }
+        Ids already in output_jsonl are skipped, so an interrupted run can simply be
+        restarted. Failed requests are not written and are retried on the next run.
+        Returns the number of responses written.
+        """
+        done = set()
+        needs_newline = False
+        if os.path.exists(output_jsonl):
+            with open(output_jsonl, 'rb') as f:
+                content = f.read()
+            needs_newline = bool(content) and not content.endswith(b"\n")
+            for line in content.splitlines():
+                try:
+                    done.add(_json_loads(line)["id"])
+                except (ValueError, KeyError, TypeError):
+                    continue  # Blank, or cut short by a crash
         
-        # Use appropriate token parameter based on model type
-        if is_reasoning_model:
-            # Reasoning models need much more tokens (they use tokens for internal reasoning)
-            reasoning_tokens = self.config.get("max_tokens", 100)
-            # For reasoning models, we need extra tokens beyond the configured amount
-            # because they use tokens for reasoning AND for the final output
-            total_tokens = max(reasoning_tokens * 10, 1000)  # At least 1000 tokens for reasoning models
-            data["max_completion_tokens"] = total_tokens
-            if self.debug:
-                print(f"[DEBUG] Reasoning model: using {total_tokens} max_completion_tokens (reasoning needs extra tokens)")
-        else:
-            data["max_tokens"] = self.config.get("max_tokens", 100)
+        pending = []
+        with open(input_jsonl, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    record = _json_loads(line)
+                    if record["id"] not in done:
+                        pending.append(record)
+        print(f"[BATCH] {len(done)} already done, {len(pending)} to process")
+        
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def one(record: Dict[str, Any]):
+            async with semaphore:
+                try:
+                    return record["id"], await self.agenerate_response(record["input"])
+                except Exception as e:
+                    # Like agenerate_many, one bad record must not sink the whole batch
+                    print(f"[BATCH] Record {record['id']!r} failed: {e!r}")
+                    return record["id"], None
+        
+        written = 0
+        with open(output_jsonl, 'ab') as out:
+            if needs_newline:
+                out.write(b"\n")
+            # Write each result as soon as it lands so a crash loses at most the in-flight ones
+            for finished in asyncio.as_completed([one(r) for r in pending]):
+                record_id, response = await finished
+                if response is None:
+                    continue
+                out.write(_json_dumps({"id": record_id, "response": response}) + b"\n")
+                out.flush()
+                written += 1
         
-        # Some reasoning models don't support temperature parameter
-        if not is_reasoning_model:
-            data["temperature"] = self.config.get("temperature", 0.7)
+        print(f"[BATCH] Wrote {written} responses to {output_jsonl}")
+        return written
+    
+    def process_file(self, input_jsonl: str, output_jsonl: str, concurrency: int = 8) -> int:
+        """Blocking version of aprocess_file."""
+        return asyncio.run(self.aprocess_file(input_jsonl, output_jsonl, concurrency))
+    
+    def close(self) -> None:
+        """Close pooled HTTP connections and the response cache."""
+        self._session.close()
+        if self._cache is not None:
+            self._cache.close()
+        if self._semantic_cache is not None:
+            self._semantic_cache.close()
+    
+    def _chat_completions(self, cfg: Dict[str, Any], input_sequence: str) -> Optional[str]:
+        """Make a chat completions request to the provider described by cfg."""
+        url, headers, tag, name = cfg["url"], cfg["headers"], cfg["tag"], cfg["name"]
+        model = cfg["params"]["model"]
+        is_reasoning_model = cfg["reasoning"]
+        debug = self.debug  # Checked many times below; load it once
+        
+        user_prompt = self._build_user_prompt(input_sequence)
+        body_parts = cfg.get("body_parts")
+        if body_parts is None:
+            body_parts = cfg["body_parts"] = self._build_body_parts(cfg["params"])
+        # Only the user prompt changes between requests; splice it into the cached body
+        body = body_parts[0] + _json_dumps(user_prompt) + body_parts[1]
+        
+        if is_reasoning_model and debug:
+            print(f"[DEBUG] Reasoning model: using {cfg['params']['max_completion_tokens']} max_completion_tokens (reasoning needs extra tokens)")
         
         try:
             if is_reasoning_model:
-                print(f"[OPENAI] Making request to reasoning model {model} (using max_completion_tokens)...")
+                print(f"[{tag}] Making request to reasoning model {model} (using max_completion_tokens)...")
             else:
-                print(f"[OPENAI] Making request to {model}...")
+                print(f"[{tag}] Making request to {model}...")
             
             # Debug: Print the request data
-            if self.debug:
+            if debug:
+                data = {**cfg["params"], "messages": [self._get_system_message(), {"role": "user", "content": user_prompt}]}
                 print(f"[DEBUG] Request data: {data}")
             
-            response = requests.post(url, headers=headers, json=data, timeout=30)
+            if self._limiter is not None:
+                self._limiter.acquire()
+            response = self._session.post(url, headers=headers, data=body, timeout=30)
             
             # Debug: Print response status
-            if self.debug:
+            if debug:
                 print(f"[DEBUG] HTTP Status Code: {response.status_code}")
                 print(f"[DEBUG] Response Headers: {dict(response.headers)}")
             
@@ -175,114 +604,188 @@ class LLMHandler:
             
             response.raise_for_status()
             
-            result = response.json()
+            result = _json_loads(response.content)
             
             # Debug: Print the full response
-            if self.debug:
+            if debug:
                 print(f"[DEBUG] Full API response: {result}")
             
             # Debug: Check response structure
             if "choices" not in result:
-                if self.debug:
+                if debug:
                     print(f"[DEBUG] No 'choices' in response!")
                 return None
             
             if len(result["choices"]) == 0:
-                if self.debug:
+                if debug:
                     print(f"[DEBUG] Empty choices array!")
                 return None
             
             choice = result["choices"][0]
-            if self.debug:
+            if debug:
                 print(f"[DEBUG] First choice: {choice}")
             
             if "message" not in choice:
-                if self.debug:
+                if debug:
                     print(f"[DEBUG] No 'message' in choice!")
                 return None
             
             message = choice["message"]
-            if self.debug:
+            if debug:
                 print(f"[DEBUG] Message object: {message}")
             
             content = message.get("content", "")
-            if self.debug:
+            if debug:
                 print(f"[DEBUG] Content: '{content}' (length: {len(content)})")
             
-            print(f"[OPENAI] Response received: {len(content)} characters")
+            print(f"[{tag}] Response received: {len(content)} characters")
             return content
             
         except requests.exceptions.RequestException as e:
-            print(f"[ERROR] OpenAI API request failed: {e}")
+            print(f"[ERROR] {name} API request failed: {e}")
             if hasattr(e, 'response') and e.response is not None:
                 try:
-                    error_details = e.response.json()
+                    error_details = _json_loads(e.response.content)
                     if 'error' in error_details:
                         print(f"[ERROR] API Error Details: {error_details['error']}")
                 except:
                     pass
             return None
-        except (KeyError, IndexError) as e:
-            print(f"[ERROR] Invalid OpenAI API response format: {e}")
+        except (KeyError, IndexError, ValueError) as e:
+            print(f"[ERROR] Invalid {name} API response format: {e}")
             return None
     
-    def _deepseek_request(self, input_sequence: str) -> Optional[str]:
-        """Make request to DeepSeek API."""
-        api_key = self.secrets.get("deepseek_api_key")
-        if not api_key:
-            raise ValueError("DeepSeek API key not found in SECRET file")
-        
-        model = self.config.get("deepseek_model", "deepseek-chat")
-        url = "https://api.deepseek.com/v1/chat/completions"
-        
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        system_prompt = self._get_system_prompt()
-        user_prompt = self._build_user_prompt(input_sequence)
-        
-        data = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            "max_tokens": self.config.get("max_tokens", 100),
-            "temperature": self.config.get("temperature", 0.7)
-        }
-        
-        try:
-            print(f"[DEEPSEEK] Making request to {model}...")
-            response = requests.post(url, headers=headers, json=data, timeout=30)
-            response.raise_for_status()
-            
-            result = response.json()
-            content = result["choices"][0]["message"]["content"]
-            
-            print(f"[DEEPSEEK] Response received: {len(content)} characters")
-            return content
-            
-        except requests.exceptions.RequestException as e:
-            print(f"[ERROR] DeepSeek API request failed: {e}")
-            return None
-        except (KeyError, IndexError) as e:
-            print(f"[ERROR] Invalid DeepSeek API response format: {e}")
-            return None
+    def _get_system_message(self) -> Dict[str, str]:
+        """Get the system chat message (built once)."""
+        system_message = self._system_message
+        if system_message is None:
+            # Only ever serialized, so one dict can be shared by every request
+            system_message = self._system_message = {"role": "system", "content": self._get_system_prompt()}
+        return system_message
+    
+    def _build_messages(self, input_sequence: str) -> List[Dict[str, str]]:
+        """Build the chat messages (system + user) for an input sequence."""
+        return [
+            self._get_system_message(),
+            {"role": "user", "content": self._build_user_prompt(input_sequence)}
+        ]
+    
+    def _build_body_parts(self, params: Dict[str, Any]):
+        """Serialize the request body once, split around the user prompt's JSON string."""
+        body = _json_dumps({
+            **params,
+            "messages": [self._get_system_message(), {"role": "user", "content": _PROMPT_SLOT}]
+        })
+        # The user message is serialized last, so its slot is the last match
+        before, slot, after = body.rpartition(_json_dumps(_PROMPT_SLOT))
+        if not slot:
+            raise ValueError("Failed to pre-serialize request body")
+        return before, after
+    
+    @staticmethod
+    def _split_prompt_template(template: str):
+        """Split a template around its single {input} field, or None if it needs str.format."""
+        pre, sep, post = template.partition("{input}")
+        if not sep or any(brace in pre or brace in post for brace in "{}"):
+            return None  # No {input}, other fields, repeated {input} or escaped braces
+        return pre, post
     
     def _build_user_prompt(self, input_sequence: str) -> str:
         """Build user prompt for LLM based on input sequence."""
-        user_prompt_template = self.config.get("user_prompt_template", 
-            "The user's input sequence: '{input}'\n\nNext keyboard input:")
-        
-        return user_prompt_template.format(input=input_sequence)
+        parts = self._prompt_parts
+        if parts is not None:
+            return parts[0] + input_sequence + parts[1]
+        return self._user_prompt_template.format(input=input_sequence)
     
     def _build_prompt(self, input_sequence: str) -> str:
         """Build prompt for LLM based on input sequence (deprecated, use _build_user_prompt)."""
         return self._build_user_prompt(input_sequence)
 
 
+class LLMHandlerPool:
+    """Spreads requests over several LLMHandlers, failing over between them."""
+    
+    def __init__(self, endpoints: List[Dict[str, Any]], cooldown: float = 30.0, debug: bool = False):
+        """Create one handler per endpoint.
+        
+        Each endpoint is {"config": {...}, "secrets": {...}, "weight": 1}; config
+        takes the same keys as LLM_config.json (plus openai_url/deepseek_url).
+        An endpoint that fails is skipped for `cooldown` seconds.
+        """
+        if not endpoints:
+            raise ValueError("LLMHandlerPool needs at least one endpoint")
+        
+        for e in endpoints:
+            if float(e.get("weight", 1)) <= 0:
+                raise ValueError(f"Endpoint weight must be positive, got {e.get('weight')!r}")
+        
+        self.cooldown = cooldown
+        self._handlers = [LLMHandler.from_dict(e.get("config", {}), e.get("secrets"), debug) for e in endpoints]
+        self._weights = [float(e.get("weight", 1)) for e in endpoints]
+        self._inflight = [0] * len(endpoints)
+        self._unhealthy_until = [0.0] * len(endpoints)
+        self._lock = threading.Lock()
+    
+    def _candidates(self) -> List[int]:
+        """Order endpoints to try: least loaded healthy ones first, then the rest."""
+        now = time.monotonic()
+        with self._lock:
+            indexes = range(len(self._handlers))
+            healthy = [i for i in indexes if self._unhealthy_until[i] <= now]
+            unhealthy = [i for i in indexes if self._unhealthy_until[i] > now]
+            healthy.sort(key=lambda i: self._inflight[i] / self._weights[i])
+            unhealthy.sort(key=lambda i: self._unhealthy_until[i])  # Soonest to recover first
+        return healthy + unhealthy
+    
+    async def agenerate(self, input_sequence: str) -> Optional[str]:
+        """Generate a response, failing over to the next endpoint on errors.
+        
+        A ValueError (input over max_prompt_chars, missing API key) is a problem
+        with the input or config, not the endpoint, so it never affects health;
+        it is re-raised if no endpoint produced a response.
+        """
+        rejected = None
+        for i in self._candidates():
+            with self._lock:
+                self._inflight[i] += 1
+            try:
+                response = await self._handlers[i].agenerate_response(input_sequence)
+            except ValueError as e:
+                print(f"[POOL] Endpoint {i} rejected the request: {e}")
+                rejected = e
+                continue
+            except Exception as e:
+                print(f"[POOL] Endpoint {i} raised: {e}")
+                response = None
+            finally:
+                with self._lock:
+                    self._inflight[i] -= 1
+            
+            # Handlers report HTTP errors and timeouts by returning None
+            with self._lock:
+                if response is None:
+                    self._unhealthy_until[i] = time.monotonic() + self.cooldown
+                else:
+                    self._unhealthy_until[i] = 0.0
+            if response is not None:
+                return response
+            print(f"[POOL] Endpoint {i} failed, trying the next one")
+        
+        if rejected is not None:
+            raise rejected
+        print("[POOL] All endpoints failed")
+        return None
+    
+    def generate(self, input_sequence: str) -> Optional[str]:
+        """Blocking version of agenerate."""
+        return asyncio.run(self.agenerate(input_sequence))
+    
+    def close(self) -> None:
+        """Close every handler in the pool."""
+        for handler in self._handlers:
+            handler.close()
+
+
 # Test function for development
 def test_llm_handler():
     """Test function to verify LLM handler works."""
@@ -8,115 +8,161 @@ Set environment variable DEBUG=1 to see detailed input/output messages.
 Example: set DEBUG=1 && python process_input.py
 """
 
+import io
 import json
 import sys
 import os
 from typing import List, Dict, Optional
 
-def read_input_events(filepath: str) -> List[Dict]:
-    """Read and parse input events from JSON file."""
+try:
+    # orjson is optional; it parses event lines several times faster than json
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Convert some common key names to more readable format for LLM understanding
+_KEY_MAPPING = {
+    "SPACE": " ",
+    "ENTER": "\n",
+    "TAB": "\t",
+    "BACKSPACE": "[BACKSPACE]",
+    "DELETE": "[DELETE]",
+    "UP_ARROW": "[UP]",
+    "DOWN_ARROW": "[DOWN]",
+    "LEFT_ARROW": "[LEFT]",
+    "RIGHT_ARROW": "[RIGHT]",
+    "HOME": "[HOME]",
+    "END": "[END]",
+    "PAGE_UP": "[PAGEUP]",
+    "PAGE_DOWN": "[PAGEDOWN]",
+    "INSERT": "[INSERT]",
+    # Only filter out modifier keys that don't add context
+    "SHIFT": "",      # Shift effect is already reflected in capitalization
+    "CTRL": "",       # Ctrl combinations are handled separately
+    "ALT": "",        # Alt combinations are handled separately
+    "CAPS_LOCK": "[CAPS]"
+}
+
+# Map mouse clicks to readable format (only show the click, not the release)
+_MOUSE_CLICKS = {
+    "leftdown": "MouseLeftClick",
+    "rightdown": "MouseRightClick",
+    "middledown": "MouseMiddleClick",
+}
+
+def _is_trailing_noise(line: str) -> bool:
+    """Check whether a raw log line is blank or a Ctrl keyboard event."""
+    # Matches the exact field layout written by EventLogger::LogKeyboardEvent
+    return not line.strip() or ('"key":"CTRL"' in line and '"type":"keyboard"' in line)
+
+def read_input_events(filepath: str) -> Optional[List[Dict]]:
+    """Read and parse input events from JSON file; None if it can't be read."""
     events = []
     
     if not os.path.exists(filepath):
         print(f"[ERROR] Input file not found: {filepath}")
-        return events
+        return None
     
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                try:
-                    event = json.loads(line)
-                    events.append(event)
-                except json.JSONDecodeError as e:
-                    print(f"[WARNING] Failed to parse line {line_num}: {e}")
-                    continue
-                    
+            lines = f.read().splitlines()
+        
+        # The log ends with the Ctrl press that triggered this run. Those events
+        # never reach the LLM (CTRL maps to ""), so drop them before parsing.
+        end = len(lines)
+        while end > 0 and _is_trailing_noise(lines[end - 1]):
+            end -= 1
+        
+        for line_num, line in enumerate(lines[:end], 1):
+            line = line.strip()
+            if not line:
+                continue
+                
+            try:
+                event = _json_loads(line)
+                events.append(event)
+            except json.JSONDecodeError as e:
+                print(f"[WARNING] Failed to parse line {line_num}: {e}")
+                continue
+                
     except Exception as e:
         print(f"[ERROR] Failed to read input file: {e}")
+        return None
         
     print(f"[INFO] Read {len(events)} events from {filepath}")
     return events
 
 
 
+def _handle_keyboard(event: Dict, write) -> None:
+    """Write the text for a keyboard event."""
+    get = event.get
+    
+    # Only process keydown events
+    if get("action") != "keydown":
+        return
+    
+    char = get("char")
+    if char and len(char) == 1:  # Single character available (the common case)
+        write(char)
+        return
+    
+    key = get("key", "")
+    if key:  # Use key name for special keys
+        mapped_key = _KEY_MAPPING.get(key)
+        if mapped_key is None:
+            mapped_key = f"[{key}]"
+        if mapped_key:  # Only append if not empty
+            write(mapped_key)
+
+def _handle_mouse(event: Dict, write) -> None:
+    """Write the text for a mouse event, for context."""
+    get = event.get
+    mouse_event = _MOUSE_CLICKS.get(get("action"))
+    if mouse_event is None:  # Releases and unknown actions add no context
+        return
+    
+    # Include position for context (rounded to nearest 50 pixels for privacy)
+    x = get("x", 0)
+    y = get("y", 0)
+    rounded_x = x - x % 50
+    rounded_y = y - y % 50
+    write(f"[{mouse_event}({rounded_x},{rounded_y})]")
+
+# Event type -> handler; other event types are ignored
+_EVENT_HANDLERS = {
+    "keyboard": _handle_keyboard,
+    "mouse": _handle_mouse,
+}
+
 def extract_input_sequence(events: List[Dict]) -> str:
     """Extract the sequence of user inputs (characters + special keys + mouse events)."""
-    input_sequence = []
+    buf = io.StringIO()
+    write = buf.write  # Bound once; called for almost every event
+    handlers = _EVENT_HANDLERS
     
     for event in events:
-        event_type = event.get("type")
-        
-        if event_type == "keyboard":
-            # Only process keydown events
-            if event.get("action") == "keydown":
-                char = event.get("char")
-                key = event.get("key", "")
-                
-                if char and len(char) == 1:  # Single character available
-                    input_sequence.append(char)
-                elif key:  # Use key name for special keys
-                    # Convert some common key names to more readable format for LLM understanding
-                    key_mapping = {
-                        "SPACE": " ",
-                        "ENTER": "\n",
-                        "TAB": "\t",
-                        "BACKSPACE": "[BACKSPACE]",
-                        "DELETE": "[DELETE]",
-                        "UP_ARROW": "[UP]",
-                        "DOWN_ARROW": "[DOWN]",
-                        "LEFT_ARROW": "[LEFT]",
-                        "RIGHT_ARROW": "[RIGHT]",
-                        "HOME": "[HOME]",
-                        "END": "[END]",
-                        "PAGE_UP": "[PAGEUP]",
-                        "PAGE_DOWN": "[PAGEDOWN]",
-                        "INSERT": "[INSERT]",
-                        # Only filter out modifier keys that don't add context
-                        "SHIFT": "",      # Shift effect is already reflected in capitalization
-                        "CTRL": "",       # Ctrl combinations are handled separately
-                        "ALT": "",        # Alt combinations are handled separately
-                        "CAPS_LOCK": "[CAPS]"
-                    }
-                    
-                    mapped_key = key_mapping.get(key, f"[{key}]")
-                    if mapped_key:  # Only append if not empty
-                        input_sequence.append(mapped_key)
-                        
-        elif event_type == "mouse":
-            # Process mouse events for context
-            action = event.get("action", "")
-            x = event.get("x", 0)
-            y = event.get("y", 0)
-            
-            # Map mouse actions to readable format
-            mouse_mapping = {
-                "leftdown": "MouseLeftClick",
-                "leftup": "",  # Only show the click, not the release
-                "rightdown": "MouseRightClick", 
-                "rightup": "",
-                "middledown": "MouseMiddleClick",
-                "middleup": ""
-            }
-            
-            mouse_event = mouse_mapping.get(action, "")
-            if mouse_event:
-                # Include position for context (rounded to nearest 50 pixels for privacy)
-                rounded_x = (x // 50) * 50
-                rounded_y = (y // 50) * 50
-                input_sequence.append(f"[{mouse_event}({rounded_x},{rounded_y})]")
+        handler = handlers.get(event.get("type"))
+        if handler is not None:
+            handler(event, write)
     
-    sequence = ''.join(input_sequence)
+    sequence = buf.getvalue()
     print(f"[INFO] Extracted input sequence: '{sequence}'")
     return sequence
 
+_LLM = None
+
+def _get_llm(debug: bool):
+    """Return the shared LLMHandler, creating it on first use."""
+    global _LLM
+    if _LLM is None:
+        from llm_handler import LLMHandler
+        _LLM = LLMHandler(debug=debug)
+    return _LLM
+
 def process_with_llm(input_sequence: str) -> Optional[str]:
     """Process input sequence with LLM and get response."""
-    import os
-    from llm_handler import LLMHandler
     from input_cleaner import clean_input_for_llm
     
     # Check if we're in debug mode (can be set via environment variable)
@@ -132,7 +178,7 @@ def process_with_llm(input_sequence: str) -> Optional[str]:
             print(f"[CLEAN] Input processed: {len(cleaned_input)} characters")
         
         # Use cleaned input for LLM
-        llm = LLMHandler(debug=debug_mode)
+        llm = _get_llm(debug_mode)
         response = llm.generate_response(cleaned_input)
         
         if response and response.strip():
@@ -170,11 +216,16 @@ def main():
     
     # Read input events
     events = read_input_events(input_file)
-    if not events:
+    if events is None:
         print("[ERROR] No events to process")
         return 1
+    if not events:
+        # Only the triggering Ctrl press was logged; that is "no completion", not a failure
+        write_output("", output_file)
+        print("[INFO] No input before the trigger, nothing to complete")
+        return 0
     
-    # Extract the input sequence for LLM (Ctrl events already filtered by input_cleaner.py)
+    # Extract the input sequence for LLM (Ctrl events are dropped by _KEY_MAPPING)
     input_sequence = extract_input_sequence(events)
     
     # Process with LLM and generate output